@@ -1,58 +1,335 @@
 import streamlit as st
 import pandas as pd
-import requests
+import aiohttp
+import asyncio
 import io
+import os
+import queue
+import tempfile
+import threading
 import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
-from PIL import Image, ImageFilter
+from imaging import DEFAULT_JPEG_QUALITY, guess_extension, process_image
 
 # --- 1. Set up the Web Page Layout ---
 st.set_page_config(page_title="Team Photo Downloader", page_icon="📸", layout="centered")
 st.title("📸 Bulk Photo Tools")
 
+jpeg_quality = st.slider(
+    "JPEG quality",
+    min_value=50,
+    max_value=100,
+    value=DEFAULT_JPEG_QUALITY,
+    help="Quality used when re-encoding images. Higher values give bigger files with little visible gain above 90.",
+)
+
 # --- 2. Shared Image Processing Logic ---
-def process_image(image_bytes):
+# process_image lives in its own module so worker processes can import (unpickle) it
+MAX_WORKERS = min(os.cpu_count() or 1, 8)
+
+# pyarrow's multithreaded CSV reader is much faster than pandas' C engine
+try:
+    import pyarrow
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    CSV_ENGINE = 'c'
+
+# calamine (Rust) parses .xlsx/.xlsm/.xlsb far faster than openpyxl/pyxlsb
+try:
+    import python_calamine
+    XLSX_ENGINE = XLSB_ENGINE = 'calamine'
+except ImportError:
+    XLSX_ENGINE, XLSB_ENGINE = 'openpyxl', 'pyxlsb'
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def read_dataframe(file_bytes, file_name):
     """
-    Opens image bytes, checks size, upscales using Lanczos, applies sharpening, 
-    and saves with max quality settings.
+    Parses the uploaded sheet. Cached on the raw bytes, so reruns with the same
+    file skip the (slow) Excel parse entirely. The cache is shared by every
+    session on the server, so it only keeps the 8 most recent sheets.
     """
-    try:
-        img = Image.open(io.BytesIO(image_bytes))
-        
-        if img.mode in ("RGBA", "P"):
-            img = img.convert("RGB")
-
-        width, height = img.size
-        min_dimension = 1000
-
-        if width < min_dimension or height < min_dimension:
-            scale_factor = min_dimension / min(width, height)
-            new_width = int(width * scale_factor)
-            new_height = int(height * scale_factor)
-            
-            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            img = img.filter(ImageFilter.UnsharpMask(radius=2, percent=150))
-        
-        output_buffer = io.BytesIO()
-        img.save(output_buffer, format="JPEG", quality=100, subsampling=0)
-        return output_buffer.getvalue()
+    buffer = io.BytesIO(file_bytes)
+    if file_name.endswith('.csv'):
+        # pyarrow rejects rows with missing trailing cells, which the C engine
+        # pads with NaN (common in hand-edited link lists), and keeps duplicate
+        # headers that the C engine renames ("Image Links", "Image Links.1")
+        try:
+            df = pd.read_csv(buffer, engine=CSV_ENGINE)
+            if df.columns.is_unique:
+                return df
+        except pd.errors.ParserError:
+            pass
+        buffer.seek(0)
+        return pd.read_csv(buffer, engine='c')
+    elif file_name.endswith('.xlsb'):
+        return pd.read_excel(buffer, engine=XLSB_ENGINE)
+    else:
+        return pd.read_excel(buffer, engine=XLSX_ENGINE)
 
-    except Exception as e:
-        return image_bytes
+@st.cache_data(show_spinner=False)
+def clean_columns(columns):
+    """
+    Maps each stripped, lower-cased column name to the first original column
+    name it came from.
+    """
+    col_map = {}
+    for c in columns:
+        col_map.setdefault(str(c).strip().lower(), c)
+    return col_map
 
 def load_dataframe(file):
     try:
-        if file.name.endswith('.csv'):
-            return pd.read_csv(file)
-        elif file.name.endswith('.xlsb'):
-            return pd.read_excel(file, engine='pyxlsb')
-        else:
-            return pd.read_excel(file, engine='openpyxl')
+        return read_dataframe(file.getvalue(), file.name)
     except Exception as e:
         st.error(f"Error reading file: {e}")
         return None
 
-# --- 3. Create Tabs for the UI ---
+def progress_interval(total):
+    """
+    Every progress/status update is a round-trip to the browser, so only send
+    one every this-many items (at most ~100 updates per run).
+    """
+    return max(1, total // 100)
+
+ZIP_SPOOL_SIZE = 256 * 1024 * 1024
+
+def new_zip_buffer():
+    """
+    Returns a file for building the ZIP in. It stays in memory up to 256 MB and
+    then transparently spills to a temp file on disk. This only bounds memory
+    while the ZIP is being built; read_zip_buffer still loads the finished
+    archive into RAM for the download button.
+    """
+    return tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_SIZE, suffix=".zip")
+
+def read_zip_buffer(zip_buffer):
+    """
+    Reads the finished ZIP back out for st.download_button, which only accepts
+    bytes/BytesIO-style data and keeps its own copy anyway.
+    """
+    with zip_buffer:
+        zip_buffer.seek(0)
+        return zip_buffer.read()
+
+def write_zip_entry(zf, filename, data):
+    """
+    Stores data in the ZIP without compression. JPEG/PNG bytes are already
+    entropy-coded, so deflating them burns CPU for almost no size reduction.
+    """
+    info = zipfile.ZipInfo(filename, date_time=datetime.now().timetuple()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    zf.writestr(info, data)
+
+# --- 3. Concurrent Link Downloads ---
+# Links go through a 3-stage pipeline so network and CPU work overlap:
+#   downloader thread (asyncio + aiohttp) -> raw_q -> process pool -> done_q -> main thread (ZIP + UI)
+MAX_CONCURRENT_DOWNLOADS = 32
+PIPELINE_DEPTH = 64
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.3
+QUEUE_POLL_INTERVAL = 0.1
+
+async def fetch(session, url):
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                response.raise_for_status()
+                # Stream into a single growing buffer instead of joining a list of chunks;
+                # getvalue() then hands back that buffer without another full copy
+                buffer = io.BytesIO()
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    buffer.write(chunk)
+                return buffer.getvalue()
+        except aiohttp.ClientConnectionError:
+            if attempt == MAX_RETRIES:
+                raise
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+def put_until_stopped(q, item, stop):
+    """
+    Blocking put that gives up once `stop` is set. Returns False if it gave up.
+    """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=QUEUE_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def get_until_stopped(q, stop):
+    """
+    Blocking get that gives up once `stop` is set. Returns None if it gave up.
+    """
+    while not stop.is_set():
+        try:
+            return q.get(timeout=QUEUE_POLL_INTERVAL)
+        except queue.Empty:
+            pass
+    return None
+
+async def download_to_queue(urls, raw_q, stop, cancel_handle):
+    """
+    Stage 1: downloads every URL concurrently and puts (url, bytes) on raw_q,
+    with None as the bytes if the download failed.
+    """
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    # Lets the main thread cancel us; checking `stop` afterwards covers the case
+    # where it gave up before the handle existed
+    cancel_handle.append(lambda: loop.call_soon_threadsafe(task.cancel))
+    if stop.is_set():
+        return
+
+    sem = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+
+    async def download(url):
+        async with sem:
+            try:
+                image_bytes = await fetch(session, url)
+            except Exception as e:
+                image_bytes = None
+            # The put blocks while raw_q is full; holding the semaphore meanwhile
+            # pauses new downloads until the process pool catches up
+            await loop.run_in_executor(None, put_until_stopped, raw_q, (url, image_bytes), stop)
+
+    # One pooled connector for the whole run, so keep-alive connections (and
+    # their TLS handshakes) are reused across images from the same host
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_DOWNLOADS, ttl_dns_cache=300)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(download(url) for url in urls))
+
+def run_downloads(urls, raw_q, stop, cancel_handle):
+    """
+    Thread body for stage 1. If it crashes, `stop` is set so the other stages
+    and the main thread don't wait on it forever.
+    """
+    try:
+        asyncio.run(download_to_queue(urls, raw_q, stop, cancel_handle))
+    except asyncio.CancelledError:
+        pass
+    except Exception:
+        stop.set()
+        raise
+
+def submit_downloads(raw_q, done_q, slots, executor, quality, total, stop):
+    """
+    Stage 2: hands each downloaded image to the process pool. Results land on
+    done_q as (url, future), or (url, None) for failed downloads. Gives up as
+    soon as `stop` is set.
+    """
+    try:
+        for _ in range(total):
+            item = get_until_stopped(raw_q, stop)
+            if item is None:
+                return
+            url, image_bytes = item
+            # Released by the main thread once it has written the result
+            while not slots.acquire(timeout=QUEUE_POLL_INTERVAL):
+                if stop.is_set():
+                    return
+            if image_bytes is None:
+                done_q.put((url, None))
+                continue
+            try:
+                future = executor.submit(process_image, image_bytes, quality)
+            except Exception as e:
+                done_q.put((url, None))
+                continue
+            future.add_done_callback(lambda f, url=url: done_q.put((url, f)))
+    except Exception:
+        stop.set()
+        raise
+
+def download_links(links, zf, executor, quality, progress_bar, status_text):
+    """
+    Downloads every valid link, resizes it in the process pool and writes each
+    result into the ZIP as it arrives. Duplicate links are only downloaded once.
+    Returns (success, errors), counted per row.
+    """
+    valid_count = 0
+    error_count = 0
+
+    # Rosters often repeat the same URL (e.g. shared headshots), so fetch each
+    # one once and remember every row that needs a copy of it
+    url_rows = {}
+    for i, url in enumerate(links):
+        if isinstance(url, str) and url.startswith(('http:', 'https:')):
+            url_rows.setdefault(url, []).append(i)
+
+    total = len(url_rows)
+    update_every = progress_interval(total)
+
+    # raw_q is bounded directly. done_q is filled from the pool's callback thread,
+    # which must never block, so it is bounded by the `slots` semaphore instead
+    raw_q = queue.Queue(maxsize=PIPELINE_DEPTH)
+    done_q = queue.Queue()
+    slots = threading.BoundedSemaphore(PIPELINE_DEPTH)
+    # Set when the run ends for any reason (finished, Streamlit rerun/stop, or a
+    # crashed stage) so the background stages wind down instead of blocking
+    stop = threading.Event()
+    cancel_handle = []
+
+    stages = [
+        threading.Thread(target=run_downloads, args=(list(url_rows), raw_q, stop, cancel_handle), daemon=True),
+        threading.Thread(target=submit_downloads, args=(raw_q, done_q, slots, executor, quality, total, stop), daemon=True),
+    ]
+    for stage in stages:
+        stage.start()
+
+    pending = set(url_rows)
+    try:
+        # zipfile is not thread-safe (and Streamlit calls belong on the script
+        # thread), so all writes and UI updates happen here
+        for done in range(1, total + 1):
+            item = get_until_stopped(done_q, stop)
+            if item is None:
+                break  # a stage crashed
+            url, future = item
+            slots.release()
+            pending.discard(url)
+            rows = url_rows[url]
+            try:
+                final_image_data = future.result() if future is not None else None
+            except Exception as e:
+                final_image_data = None
+
+            if final_image_data is None:
+                error_count += len(rows)
+            else:
+                extension = guess_extension(final_image_data)
+                for i in rows:
+                    filename = f"image_{i+1:03d}{extension}"
+                    write_zip_entry(zf, filename, final_image_data)
+                valid_count += len(rows)
+            if done % update_every == 0 or done == total:
+                status_text.text(f"Processed {done} of {total}")
+                progress_bar.progress(done / total)
+    finally:
+        stop.set()
+        for cancel in cancel_handle:
+            try:
+                cancel()
+            except RuntimeError:
+                pass  # event loop already closed
+        for stage in stages:
+            stage.join()
+        # Drop any downloaded images nobody will process
+        while True:
+            try:
+                raw_q.get_nowait()
+            except queue.Empty:
+                break
+
+    # Links left over after a crashed stage count as errors
+    error_count += sum(len(url_rows[url]) for url in pending)
+
+    return valid_count, error_count
+
+# --- 4. Create Tabs for the UI ---
 tab1, tab2 = st.tabs(["📥 Download from Excel Links", "🖥️ Enlarge Local Photos"])
 
 # ==========================================
@@ -69,48 +346,33 @@ with tab1:
         else:
             df = load_dataframe(uploaded_file)
             if df is not None:
-                cols_clean = [c.strip().lower() for c in df.columns]
+                col_map = clean_columns(tuple(df.columns))
                 target_clean = column_name.strip().lower()
                 
-                if target_clean not in cols_clean:
+                if target_clean not in col_map:
                     st.error(f"Column '{column_name}' not found. Available columns: {list(df.columns)}")
                 else:
-                    original_col_name = df.columns[cols_clean.index(target_clean)]
+                    original_col_name = col_map[target_clean]
                     links = df[original_col_name].dropna().tolist()
                     total = len(links)
                     
                     progress_bar = st.progress(0)
                     status_text = st.empty()
-                    zip_buffer = io.BytesIO()
-                    valid_count = 0
-                    error_count = 0
-
-                    with zipfile.ZipFile(zip_buffer, "w") as zf:
-                        for i, url in enumerate(links):
-                            status_text.text(f"Processing {i+1} of {total}: {url}")
-                            try:
-                                if not isinstance(url, str) or not url.startswith(('http:', 'https:')):
-                                    continue
-                                response = requests.get(url, timeout=10)
-                                response.raise_for_status()
-                                
-                                final_image_data = process_image(response.content)
-                                filename = f"image_{i+1:03d}.jpg"
-                                zf.writestr(filename, final_image_data)
-                                valid_count += 1
-                            except Exception as e:
-                                error_count += 1
-                            progress_bar.progress((i + 1) / total)
+                    zip_buffer = new_zip_buffer()
+
+                    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor, zipfile.ZipFile(zip_buffer, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+                        valid_count, error_count = download_links(
+                            links, zf, executor, jpeg_quality, progress_bar, status_text
+                        )
 
                     status_text.text("Processing Complete!")
                     st.success(f"Processed {total} links. Success: {valid_count}, Errors: {error_count}")
                     
-                    zip_buffer.seek(0)
                     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                     
                     st.download_button(
                         label="Download ZIP File",
-                        data=zip_buffer,
+                        data=read_zip_buffer(zip_buffer),
                         file_name=f"Downloaded_Photos_{timestamp}.zip",
                         mime="application/zip",
                         key="dl_links"
@@ -132,33 +394,42 @@ with tab2:
             total = len(local_photos)
             progress_bar = st.progress(0)
             status_text = st.empty()
-            zip_buffer = io.BytesIO()
+            zip_buffer = new_zip_buffer()
             
             success_count = 0
+            error_count = 0
             
-            with zipfile.ZipFile(zip_buffer, "w") as zf:
-                for i, photo_file in enumerate(local_photos):
-                    status_text.text(f"Processing {i+1} of {total}: {photo_file.name}")
-                    
-                    # Read the bytes of the uploaded file
-                    photo_bytes = photo_file.getvalue()
-                    
-                    # Run it through our shared upscale/sharpen logic
-                    processed_bytes = process_image(photo_bytes)
-                    
-                    # Keep original filename, force .jpg extension since we save as JPEG
-                    base_name = photo_file.name.rsplit('.', 1)[0]
-                    new_filename = f"{base_name}_enlarged.jpg"
-                    
-                    zf.writestr(new_filename, processed_bytes)
-                    success_count += 1
+            with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor, zipfile.ZipFile(zip_buffer, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+                # Run every photo through our shared upscale/sharpen logic in parallel
+                futures = {
+                    executor.submit(process_image, photo_file.getvalue(), jpeg_quality): photo_file.name
+                    for photo_file in local_photos
+                }
+
+                update_every = progress_interval(total)
+
+                for i, future in enumerate(as_completed(futures)):
+                    photo_name = futures[future]
+                    try:
+                        # Raises e.g. BrokenProcessPool if a worker was OOM-killed
+                        processed_bytes = future.result()
+                    except Exception as e:
+                        error_count += 1
+                    else:
+                        # Keep original filename; the extension follows the actual output
+                        # format, since anything we couldn't process is passed through as-is
+                        base_name = photo_name.rsplit('.', 1)[0]
+                        new_filename = f"{base_name}_enlarged{guess_extension(processed_bytes)}"
+                        
+                        write_zip_entry(zf, new_filename, processed_bytes)
+                        success_count += 1
                     
-                    progress_bar.progress((i + 1) / total)
+                    if (i + 1) % update_every == 0 or i + 1 == total:
+                        status_text.text(f"Processed {i+1} of {total}")
+                        progress_bar.progress((i + 1) / total)
             
             status_text.text("Processing Complete!")
-            st.success(f"Successfully enlarged {success_count} photos.")
-            
-            zip_buffer.seek(0)
+            st.success(f"Processed {total} photos. Success: {success_count}, Errors: {error_count}")
             
             # Generate the dynamic folder name you requested
             current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
@@ -166,7 +437,7 @@ with tab2:
             
             st.download_button(
                 label="Download Enlarged Photos (ZIP)",
-                data=zip_buffer,
+                data=read_zip_buffer(zip_buffer),
                 file_name=zip_filename,
                 mime="application/zip",
                 key="dl_local"
@@ -0,0 +1,151 @@
+import io
+import cv2
+import numpy as np
+from cykooz_resizer import FilterType, ImageData, PixelType, ResizeAlg, ResizeOptions, Resizer
+from PIL import Image, ImageFilter
+
+# libjpeg-turbo (SIMD DCT/Huffman) is used for JPEG decode/encode when the
+# system library is installed; otherwise OpenCV handles JPEGs as well
+try:
+    from turbojpeg import TJSAMP_420, TurboJPEG
+    TURBO_JPEG = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    TURBO_JPEG = None
+
+MIN_DIMENSION = 1000
+EXIF_ORIENTATION = 0x0112
+# Quality 90 with 4:2:0 chroma subsampling is visually indistinguishable from
+# 100/4:4:4 on photos, at a fraction of the file size and encode time
+DEFAULT_JPEG_QUALITY = 90
+
+# Leading "magic" bytes used to name output that skipped processing: large
+# JPEGs returned as-is, or payloads nothing could decode. GIF/BMP/WebP/PNG
+# inputs that decode are re-encoded as JPEG like everything else
+IMAGE_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"GIF8", ".gif"),
+]
+
+def guess_extension(data):
+    """
+    Picks a file extension from the image's magic bytes rather than trusting
+    the Content-Type header or the uploaded name. Defaults to .jpg.
+    """
+    head = data[:12]
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return next((ext for magic, ext in IMAGE_SIGNATURES if head.startswith(magic)), ".jpg")
+
+def upscaled_size(width, height):
+    """
+    Returns the (width, height) needed for the shortest side to reach
+    MIN_DIMENSION, or None if the image is already big enough.
+    """
+    if width >= MIN_DIMENSION and height >= MIN_DIMENSION:
+        return None
+    scale_factor = MIN_DIMENSION / min(width, height)
+    return int(width * scale_factor), int(height * scale_factor)
+
+LANCZOS3 = ResizeOptions(resize_alg=ResizeAlg.convolution(FilterType.lanczos3))
+RESIZER = Resizer()
+
+def resize_lanczos(img, new_size):
+    """
+    Resizes a 3-channel uint8 array with the SIMD Lanczos3 kernels from
+    fast_image_resize (via cykooz.resizer).
+    """
+    height, width = img.shape[:2]
+    new_width, new_height = new_size
+    src = ImageData(width, height, PixelType.U8x3, img.tobytes())
+    dst = ImageData(new_width, new_height, PixelType.U8x3)
+    RESIZER.resize(src, dst, LANCZOS3)
+    return np.frombuffer(dst.get_buffer(), np.uint8).reshape(new_height, new_width, 3)
+
+def decode_image(image_bytes, use_turbo):
+    """
+    Decodes image bytes to a 3-channel BGR array, or returns None if neither
+    libjpeg-turbo nor OpenCV can read them.
+    """
+    if use_turbo and TURBO_JPEG is not None:
+        try:
+            return TURBO_JPEG.decode(image_bytes)
+        except OSError:
+            pass  # e.g. CMYK JPEGs; let OpenCV have a go
+
+    # IMREAD_COLOR always yields 3-channel BGR, dropping any alpha channel
+    return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+
+def encode_jpeg(img, quality):
+    """
+    Encodes a BGR array as a 4:2:0 JPEG at the given quality.
+    """
+    if TURBO_JPEG is not None:
+        return TURBO_JPEG.encode(img, quality=quality, jpeg_subsample=TJSAMP_420)
+
+    params = [
+        cv2.IMWRITE_JPEG_QUALITY, quality,
+        cv2.IMWRITE_JPEG_SAMPLING_FACTOR, cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420,
+    ]
+    ok, encoded = cv2.imencode(".jpg", img, params)
+    if not ok:
+        raise ValueError("OpenCV could not encode the image")
+    return encoded.tobytes()
+
+def process_image(image_bytes, quality=DEFAULT_JPEG_QUALITY):
+    """
+    Decodes image bytes with libjpeg-turbo/OpenCV, upscales using Lanczos if needed, applies
+    sharpening, and encodes as JPEG at the given quality. JPEGs that are already
+    big enough are returned untouched. Falls back to Pillow for anything OpenCV
+    cannot handle.
+    """
+    try:
+        # Image.open only parses the header here; pixels are never decoded
+        with Image.open(io.BytesIO(image_bytes)) as header:
+            if header.format == "JPEG" and upscaled_size(*header.size) is None:
+                return image_bytes
+
+            # libjpeg-turbo ignores EXIF orientation, so rotated photos go through
+            # OpenCV, which applies it while decoding
+            use_turbo = header.format == "JPEG" and header.getexif().get(EXIF_ORIENTATION, 1) == 1
+
+        img = decode_image(image_bytes, use_turbo)
+        if img is None:
+            raise ValueError("Could not decode the image")
+
+        height, width = img.shape[:2]
+        new_size = upscaled_size(width, height)
+
+        if new_size is not None:
+            img = resize_lanczos(img, new_size)
+            # Unsharp mask equivalent to Pillow's UnsharpMask(radius=2, percent=150)
+            blurred = cv2.GaussianBlur(img, (0, 0), sigmaX=2.0)
+            img = cv2.addWeighted(img, 2.5, blurred, -1.5, 0)
+
+        return encode_jpeg(img, quality)
+
+    except Exception as e:
+        return process_image_pillow(image_bytes, quality)
+
+def process_image_pillow(image_bytes, quality=DEFAULT_JPEG_QUALITY):
+    """
+    Pillow version of process_image, used for formats OpenCV cannot decode.
+    """
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        
+        if img.mode in ("RGBA", "P"):
+            img = img.convert("RGB")
+
+        new_size = upscaled_size(*img.size)
+
+        if new_size is not None:
+            img = img.resize(new_size, Image.Resampling.LANCZOS)
+            img = img.filter(ImageFilter.UnsharpMask(radius=2, percent=150))
+        
+        output_buffer = io.BytesIO()
+        img.save(output_buffer, format="JPEG", quality=quality, subsampling=2)
+        return output_buffer.getvalue()
+
+    except Exception as e:
+        return image_bytes